@@ -1,4 +1,7 @@
-import os, logging, json, requests
+import os, logging, functools, hashlib, orjson, requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 logger = logging.getLogger(__name__)
 
@@ -140,6 +143,30 @@ class Agent:
         }
     }
 
+    ARTICLE_BUNDLE_SCHEMA = {   # 一次產生單字表 + 心智圖 + 閱讀測驗的 JSON Schema
+        "type": "object",
+        "properties": {
+            "voc": NEWS_VOC_SCHEMA,
+            "mind_map": MIND_MAP_SCHEMA,
+            "reading_quiz": READING_QUIZ_SCHEMA,
+        },
+        "required": ["voc", "mind_map", "reading_quiz"],
+        "additionalProperties": False,
+    }
+
+    # schema 是固定的類別常數, 在 class 載入時就先序列化一次,
+    # 之後每次組 prompt 直接用字串, 不用重跑一遍 json.dumps
+    NEWS_VOC_SCHEMA_STR = orjson.dumps(NEWS_VOC_SCHEMA, option=orjson.OPT_INDENT_2).decode()
+    CHECK_VOC_SCHEMA_STR = orjson.dumps(CHECK_VOC_SCHEMA, option=orjson.OPT_INDENT_2).decode()
+    MIND_MAP_SCHEMA_STR = orjson.dumps(MIND_MAP_SCHEMA, option=orjson.OPT_INDENT_2).decode()
+    READING_QUIZ_SCHEMA_STR = orjson.dumps(READING_QUIZ_SCHEMA, option=orjson.OPT_INDENT_2).decode()
+    ARTICLE_BUNDLE_SCHEMA_STR = orjson.dumps(ARTICLE_BUNDLE_SCHEMA, option=orjson.OPT_INDENT_2).decode()
+
+    # 各 schema 的必要欄位, 在 class 載入時取出一次, 驗證回覆用
+    _NEWS_VOC_REQUIRED = frozenset(NEWS_VOC_SCHEMA["items"]["required"])
+    _CHECK_VOC_REQUIRED = frozenset(CHECK_VOC_SCHEMA["items"]["required"])
+    _MIND_MAP_REQUIRED = frozenset(MIND_MAP_SCHEMA["required"])
+
 
     def __init__(self, api_url = None, api_key = None, model = "gpt-oss:120b", timeout = 30):
         """
@@ -157,7 +184,41 @@ class Agent:
         
         self.model = model
         self.timeout = timeout
-    
+
+        # headers 不會變, 先建好一份重複使用
+        self._headers = self._build_headers()
+
+        # (prompt hash, parse_json) -> 回覆 的快取
+        # 同一篇文章 + 同樣設定重複操作時, 直接回快取, 不再打 API
+        self._cache = {}
+
+        # 共用一條 keep-alive 連線, 避免每次呼叫 LLM 都重新 TCP + TLS 握手
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.2,
+                status_forcelist=[502, 503, 504],
+                # 預設的 allowed_methods 不含 POST, 這裡的請求全是 POST,
+                # 設成 None 才會真的在 502/503/504 時重試
+                allowed_methods=None,
+            ),
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def close(self):
+        """關閉 HTTP 連線池"""
+        self._session.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
     @staticmethod
     def _extract_json(msg):
         """
@@ -167,37 +228,33 @@ class Agent:
         :param msg: 要解析的訊息 (string)
         :return: 解析後的 JSON 物件, 失敗回傳 None
         """
-        start = msg.find("```json")
-        if start == -1:
+        # partition 一次掃完就切好, 不用 find + rfind 各掃一遍再另外切 slice
+        _, sep, rest = msg.partition("```json")
+        if not sep:
             # 沒有 markdown block, 就嘗試直接把整段 msg 當成 JSON
+            # (orjson 容許前後空白, 不需要先 strip)
             try:
-                return json.loads(msg)
-            except json.JSONDecodeError:
+                return orjson.loads(msg)
+            except orjson.JSONDecodeError:
                 logger.exception("Failed to decode JSON from raw content")
                 return None
-            finally:
-                logger.debug("_extract_json() finished for raw content")
 
-        start += len("```json")
-        end = msg.rfind("```")
-        if end == -1 or end <= start:
+        json_str, sep, _ = rest.rpartition("```")
+        if not sep:
             logger.error("Cannot find closing ``` for json block")
             return None
 
-        json_str = msg[start:end].strip()
         try:
-            data = json.loads(json_str)
-            return data
-        except json.JSONDecodeError:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
             logger.exception("Failed to decode JSON from markdown block")
             return None
-        finally:
-            logger.debug("_extract_json() finished for markdown block")
         
     def _build_headers(self):
         """建立 HTTP headers """
         headers = {
             "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
         }
         return headers
 
@@ -217,27 +274,56 @@ class Agent:
 
         response = None
         try:
-            # 為了避免 log 太長，只顯示前 100 個字
-            debug_payload = json.dumps(payload, ensure_ascii=False)[:100]
-            logger.debug(f"Sending request to {self.api_url} with payload: {debug_payload}")
-
-            response = requests.post(
-                self.api_url, 
-                headers=self._build_headers(), 
-                json=payload,
+            if logger.isEnabledFor(logging.DEBUG):
+                # 為了避免 log 太長，只顯示前 100 個字
+                debug_payload = orjson.dumps(payload)[:100].decode(errors="replace")
+                logger.debug("Sending request to %s with payload: %s", self.api_url, debug_payload)
+
+            # 自己用 orjson 序列化 payload, 比 requests 內建的 json= 走 stdlib 快
+            response = self._session.post(
+                self.api_url,
+                headers=self._headers,
+                data=orjson.dumps(payload),
                 timeout=self.timeout,
+                stream=stream,
             )
             response.raise_for_status()
         except requests.Timeout:
             logger.exception("Request timeout when calling %s", self.api_url)
             return None
         except requests.RequestException as e:
-            logger.exception(f"Request failed: {e}")
+            logger.exception("Request failed: %s", e)
         else:
-            logger.info(f"Request success: status={response.status_code}")
+            logger.info("Request success: status=%s", response.status_code)
             return response
         finally:
-            logger.debug(f"chat() finished for messages count={len(messages)}")
+            logger.debug("chat() finished for messages count=%d", len(messages))
+
+    def _iter_stream_content(self, response):
+        """
+        逐行解析 stream 模式的 NDJSON 回覆
+
+        :param response: stream=True 的 requests.Response 物件
+        :return: generator, 逐段產出新增的 message.content 文字
+        """
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    logger.warning("Skip malformed stream line")
+                    continue
+
+                msg = chunk.get("message")
+                if isinstance(msg, dict) and msg.get("content"):
+                    yield msg["content"]
+
+                if chunk.get("done"):
+                    break
+        finally:
+            response.close()
 
     def _parse_response(self, response):
         """
@@ -247,12 +333,10 @@ class Agent:
         :return: message.content 字串, 失敗回傳 None
         """
         try:
-            data = response.json()
-        except json.JSONDecodeError:
+            data = orjson.loads(response.content)
+        except orjson.JSONDecodeError:
             logger.exception("Failed to parse JSON response")
             return None
-        finally:
-            logger.debug(f"_parse_response() finished for response status={response.status_code}")
 
         if not isinstance(data, dict):
             logger.error("Unexpected JSON type (not dict)")
@@ -270,20 +354,88 @@ class Agent:
 
         return content
 
+    # ------------ LLM 回覆的結構驗證 ------------
+    @classmethod
+    def validate_news_voc(cls, data):
+        """檢查整理單字的回覆是否包含 NEWS_VOC_SCHEMA 的必要欄位"""
+        return isinstance(data, list) and all(
+            isinstance(item, dict) and cls._NEWS_VOC_REQUIRED <= item.keys()
+            for item in data
+        )
+
+    @classmethod
+    def validate_check_voc(cls, data):
+        """檢查單字檢查的回覆是否包含 CHECK_VOC_SCHEMA 的必要欄位"""
+        return isinstance(data, list) and all(
+            isinstance(item, dict) and cls._CHECK_VOC_REQUIRED <= item.keys()
+            for item in data
+        )
+
+    @classmethod
+    def validate_mind_map(cls, data):
+        """遞迴檢查心智圖的每個節點是否包含 id / text / children"""
+        if not isinstance(data, dict) or not cls._MIND_MAP_REQUIRED <= data.keys():
+            return False
+        children = data["children"]
+        return isinstance(children, list) and all(
+            cls.validate_mind_map(child) for child in children
+        )
+
+    @classmethod
+    def validate_article_bundle(cls, data):
+        """檢查一次生成三種教材的回覆, 三個部分都要各自通過驗證"""
+        return (
+            isinstance(data, dict)
+            and cls.validate_news_voc(data.get("voc"))
+            and cls.validate_mind_map(data.get("mind_map"))
+            and cls.validate_reading_quiz(data.get("reading_quiz"))
+        )
+
+    @staticmethod
+    def validate_reading_quiz(data):
+        """檢查閱讀測驗的每一題是否有該題型需要的欄位"""
+        if not isinstance(data, list):
+            return False
+        for item in data:
+            if not isinstance(item, dict) or "type" not in item or "question" not in item:
+                return False
+            if item["type"] == "Multiple_Answer":
+                if "choices" not in item or "correct_choices" not in item:
+                    return False
+            elif item["type"] == "True_Or_False":
+                if "answer" not in item:
+                    return False
+            else:
+                return False
+        return True
+
     # ------------ 對外 API ------------
-    def chat_with_prompt(self, prompt, stream = False, parse_json=True):
+    def chat_with_prompt(self, prompt, stream = False, parse_json=True, validator=None):
         """
         使用給定的 prompt 與 LLM 互動
 
         :param prompt: 要給 LLM 的內容 (string)
-        :param stream: 是否使用 stream 模式
+        :param stream: 是否使用 stream 模式, 回傳逐段文字的 generator
+                       (此時忽略 parse_json / validator)
         :param parse_json: 是否要把回覆解析成 JSON 物件
+        :param validator: 解析後 JSON 的結構檢查函式, 不過就回傳 None
         :return: 回覆的純文字 (string) 或 JSON 物件, 失敗回傳 None
         """
         if not prompt:
             logger.warning("Empty prompt, skip calling API")
             return None
-        
+
+        # stream 模式不快取 (回傳的是逐步內容, 不是完整結果)
+        cache_key = None
+        if not stream:
+            digest = hashlib.blake2b(
+                f"{self.model}|{prompt}".encode(), digest_size=16
+            ).hexdigest()
+            cache_key = (digest, parse_json)
+            if cache_key in self._cache:
+                logger.info("Prompt cache hit, skip calling API")
+                return self._cache[cache_key]
+
         messages = [
             {"role": "user", "content": prompt},
         ]
@@ -291,17 +443,56 @@ class Agent:
 
         if response is None:
             return None
-        
+
+        if stream:
+            # 邊收邊吐, 讓呼叫端可以先顯示前面的內容, 不用等整段回完
+            return self._iter_stream_content(response)
+
         content = self._parse_response(response)
         if content is None:
             return None
 
         if not parse_json:
             # 預設: 只回傳純文字
-            return content
-        # 需要 JSON 的: 整理新聞單字、檢查單字使用正確性
-        return self._extract_json(content)
+            result = content
+        else:
+            # 需要 JSON 的: 整理新聞單字、檢查單字使用正確性
+            result = self._extract_json(content)
+            if result is not None and validator is not None and not validator(result):
+                logger.error("LLM response failed schema validation")
+                return None
+
+        # 只快取成功的結果
+        if cache_key is not None and result is not None:
+            self._cache[cache_key] = result
+        return result
+
+    def chat_many(self, prompts, parse_json=True, max_workers=4):
+        """
+        同時發出多個互相獨立的 prompt, 等待全部完成
+
+        每個 LLM 呼叫幾乎都在等網路, 用 thread pool 並行發送可以把
+        總等待時間從「逐一相加」變成「最慢的那一個」, session 連線池會被共用
+
+        :param prompts: prompt 字串的 list
+        :param parse_json: 是否要把每個回覆解析成 JSON 物件
+        :param max_workers: 最多同時幾個請求
+        :return: 與 prompts 順序對應的結果 list, 個別失敗的項目為 None
+        """
+        if not prompts:
+            logger.warning("Empty prompts, skip calling API")
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(prompts))) as executor:
+            results = list(executor.map(
+                lambda p: self.chat_with_prompt(p, parse_json=parse_json),
+                prompts,
+            ))
+        return results
 
+    # 參數都是 hashable 的 prompt builder 用 lru_cache,
+    # 同一篇文章重複點擊時連組字串都省下來
+    @functools.lru_cache(maxsize=128)
     def generate_prompt_of_voc(self, text_for_llm, CEFR = "B2", voc_numbers = 10):
         """
         產生要給 LLM 的內容: 整理英文新聞的單字
@@ -315,7 +506,7 @@ class Agent:
             logger.warning(f"Text for LLM is empty, skip")
             return None
         
-        schema_str = json.dumps(self.NEWS_VOC_SCHEMA, indent=2, ensure_ascii=False)
+        schema_str = self.NEWS_VOC_SCHEMA_STR
 
         prompt = (
             text_for_llm
@@ -346,12 +537,12 @@ class Agent:
             logger.warning("The length of word list and sentences list do not match, skip")
             return None
         
-        schema_str = json.dumps(self.CHECK_VOC_SCHEMA, indent=2, ensure_ascii=False)
+        schema_str = self.CHECK_VOC_SCHEMA_STR
         prompt = (
             "請幫我檢查以下英文句子中，指定的單字是否有被正確使用，並且用繁體中文說明原因。\n"
             "以下是要檢查的資料（索引對應）：\n\n"
-            f"word_list = {json.dumps(word_list, ensure_ascii=False)}\n"
-            f"sentences_list = {json.dumps(sentences_list, ensure_ascii=False)}\n\n"
+            f"word_list = {orjson.dumps(word_list).decode()}\n"
+            f"sentences_list = {orjson.dumps(sentences_list).decode()}\n\n"
             "輸出格式為 JSON 陣列，其 JSON Schema 如下：\n"
             "```json\n"
             + schema_str
@@ -377,10 +568,11 @@ class Agent:
             "並且每個單字都要出現一次，且只能出現一次。\n"
             f"難度請符合 CEFR 等級：{CEFR}。\n"
             "回覆請使用純文字英文，不要加上任何說明、標題或 markdown 格式。\n\n"
-            f"單字清單: {json.dumps(word_list, ensure_ascii=False)}"
+            f"單字清單: {orjson.dumps(word_list).decode()}"
         )
         return prompt
 
+    @functools.lru_cache(maxsize=128)
     def generate_prompt_of_describe_word(self, word, CEFR = "B2"):
         """
         產生要給 LLM 的內容: hangman 遊戲中的提示, 用英文描述單字
@@ -401,6 +593,7 @@ class Agent:
         )
         return prompt
     
+    @functools.lru_cache(maxsize=128)
     def generate_prompt_of_mind_map(self, article):
         """
         產生要給 LLM 的內容: 新聞文章的心智圖
@@ -412,7 +605,7 @@ class Agent:
             logger.warning("The article is empty, skip")
             return None
         
-        schema_str = json.dumps(self.MIND_MAP_SCHEMA, indent=2, ensure_ascii=False)
+        schema_str = self.MIND_MAP_SCHEMA_STR
 
         prompt = (
             article
@@ -430,6 +623,7 @@ class Agent:
         )
         return prompt
     
+    @functools.lru_cache(maxsize=128)
     def generate_prompt_of_reading_quiz(self, article):
         """
         產生要給 LLM 的內容: 新聞文章的心智圖
@@ -441,7 +635,7 @@ class Agent:
             logger.warning("The article is empty, skip")
             return None
         
-        schema_str = json.dumps(self.READING_QUIZ_SCHEMA, indent=2, ensure_ascii=False)
+        schema_str = self.READING_QUIZ_SCHEMA_STR
 
         prompt = (
             article
@@ -455,4 +649,62 @@ class Agent:
             "整段回答必須被 ```json 與 ``` 包起來，且不要加入任何額外說明文字。"
         )
         return prompt
-    
+
+    @functools.lru_cache(maxsize=128)
+    def generate_prompt_of_article_bundle(self, article, CEFR = "B2", voc_numbers = 10):
+        """
+        產生要給 LLM 的內容: 一次生成單字表、心智圖、閱讀測驗
+
+        同一篇文章的三種教材各自發一次請求, 文章全文就要重傳三次;
+        打包成一個 prompt 只要一次網路往返, 文章也只上傳一份
+
+        :param article: 新聞文章全文
+        :param CEFR: 使用者輸入的 CEFR 等級, 預設 B2
+        :param voc_numbers: 單字表要產生的單字數量, 預設 10
+        :return: prompt 字串
+        """
+        if not article or not article.strip():
+            logger.warning("The article is empty, skip")
+            return None
+
+        prompt = (
+            article
+            + "\n\n根據這段英文文章，同時生成三種教材，放在同一個 JSON 物件的三個欄位："
+            + f"\n- voc: 依據 CEFR={CEFR} 整理出 {voc_numbers} 個單字，"
+            "要不多不少剛剛好的數量，如果不夠的話請往低一階的程度找"
+            + "\n- mind_map: 相符合的英文心智圖結構，root 節點代表文章主題，"
+            "children 逐層拆成主要分支與次分支"
+            + "\n- reading_quiz: 相對應的英文閱讀測驗，"
+            "題目類型為 Multiple_Answer 或 True_Or_False，總共 5 題"
+            + "\n輸出格式為 JSON 物件，其 JSON Schema 如下：\n"
+            "```json\n"
+            + self.ARTICLE_BUNDLE_SCHEMA_STR
+            + "\n```\n"
+            "請輸出一個完全符合上述 JSON Schema 的 JSON，"
+            "整段回答必須被 ```json 與 ``` 包起來，且不要加入任何額外說明文字。"
+        )
+        return prompt
+
+    def analyze_article(self, article, CEFR = "B2", voc_numbers = 10):
+        """
+        用一次 LLM 呼叫取得同一篇文章的單字表、心智圖、閱讀測驗
+
+        :param article: 新聞文章全文
+        :param CEFR: 使用者輸入的 CEFR 等級, 預設 B2
+        :param voc_numbers: 單字表要產生的單字數量, 預設 10
+        :return: (voc, mind_map, reading_quiz) tuple, 失敗回傳 None
+        """
+        prompt = self.generate_prompt_of_article_bundle(article, CEFR, voc_numbers)
+        if not prompt:
+            return None
+
+        bundle = self.chat_with_prompt(
+            prompt,
+            parse_json=True,
+            validator=self.validate_article_bundle,
+        )
+        if bundle is None:
+            return None
+
+        return bundle["voc"], bundle["mind_map"], bundle["reading_quiz"]
+
@@ -1,9 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
-import json
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, send_from_directory, make_response, abort
+import orjson
 import os
 import re
 import random
 import logging
+import secrets
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from english_learning_service import EnglishLearningService
 
@@ -18,10 +22,280 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = "hangman-secret-key"
 
+# 整個 process 共用一個 service, 讓 Agent 的連線池和快取跨 request 生效
+# Agent 建構時需要 OLLAMA_API_KEY, 沒設的話不要讓 import 直接掛掉,
+# 延後到真正用到時再報錯
+try:
+    SERVICE = EnglishLearningService()
+except RuntimeError:
+    logger.warning("OLLAMA_API_KEY not set, service will be created lazily")
+    SERVICE = None
+
+def _get_service():
+    global SERVICE
+    if SERVICE is None:
+        SERVICE = EnglishLearningService()
+    return SERVICE
+
+# 以 (path -> (mtime, 解析後的物件)) 快取資料檔,
+# 同一個檔案沒被改寫前, 後續 request 直接拿記憶體裡的結果, 不再讀檔 + 重新解析
+# 在多執行緒的 WSGI server 下會被多個 request 同時存取, 所以加鎖
+_FILE_CACHE = {}
+_FILE_CACHE_LOCK = threading.Lock()
+
+def _load_file(path, parser):
+    mtime = os.stat(path).st_mtime_ns
+
+    with _FILE_CACHE_LOCK:
+        cached = _FILE_CACHE.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    with open(path, 'rb') as f:
+        data = parser(f.read())
+
+    with _FILE_CACHE_LOCK:
+        _FILE_CACHE[path] = (mtime, data)
+    return data
+
+def _load_json(path):
+    return _load_file(path, orjson.loads)
+
+def _load_text(path):
+    return _load_file(path, lambda raw: raw.decode('utf-8'))
+
+def _warm_cache():
+    """把 data/ 下現有的 JSON 先讀進快取, 第一個 request 就不用等磁碟跟解析"""
+    for root, _dirs, files in os.walk('data'):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                _load_json(path)
+            except (OSError, orjson.JSONDecodeError):
+                logger.warning("skip warming cache for %s", path)
+
+# 在背景預熱, 不拖慢 import / 啟動
+threading.Thread(target=_warm_cache, daemon=True).start()
+
+def _form_int(name, default=None):
+    """
+    安全地把表單欄位轉成 int
+
+    :param name: 表單欄位名稱
+    :param default: 欄位缺少或不是數字時回傳的值
+    """
+    value = request.form.get(name)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+# news/*.json 的衍生資料快取, 以 _load_json 回傳的物件當 key
+# (檔案重寫後 _load_json 會給新物件, 舊的索引自然失效)
+_NEWS_DERIVED = {}
+
+def _load_news(category):
+    """
+    讀取某分類的新聞檔, 並附上 id -> article 的索引
+
+    建好索引之後, 查某篇文章只是一次 dict lookup,
+    不用每個 request 都線性掃一次 articles
+    """
+    news_data = _load_json(f"data/news/{category}.json")
+
+    cached = _NEWS_DERIVED.get(category)
+    if cached is None or cached[0] is not news_data:
+        articles = news_data["articles"]
+        by_id = {a["id"]: a for a in articles}
+        # 列表頁只需要標題和前段預覽, 先投影掉全文,
+        # Jinja context 就不用帶著每篇文章的整包內容
+        list_view = [
+            {
+                "id": a["id"],
+                "title": a["title"],
+                "preview": (a.get("content") or "")[:120],
+            }
+            for a in articles
+        ]
+        cached = (news_data, by_id, list_view)
+        _NEWS_DERIVED[category] = cached
+
+    return news_data, cached[1], cached[2]
+
+# words.json 的衍生資料快取, 存成 tuple 讓共用的快取物件不會被 handler 改到
+_WORDS_DERIVED = {}
+
+def _load_words(count=None):
+    """
+    讀取單字表, 要前 N 個單字就直接切片
+
+    :param count: 要取的單字數, None 表示整份
+    """
+    words = _load_json('data/vocabulary/words.json')
+
+    cached = _WORDS_DERIVED.get('words')
+    if cached is None or cached[0] is not words:
+        cached = (words, tuple(words))
+        _WORDS_DERIVED['words'] = cached
+
+    all_words = cached[1]
+    return all_words if count is None else all_words[:count]
+
+# reading.json 的衍生資料快取, 以 _load_json 回傳的物件當 key
+_READING_DERIVED = {}
+
+def _load_reading():
+    """
+    讀取 reading.json, 並附上每題預先算好的正解集合
+
+    Multiple_Answer 的正解轉成 frozenset,
+    對答案時做集合比較, 不用每次 submit 都 sorted() 兩個 list
+    """
+    questions = _load_json('data/reading.json')
+
+    cached = _READING_DERIVED.get('reading')
+    if cached is None or cached[0] is not questions:
+        correct_sets = {}
+        for idx, q in enumerate(questions):
+            qid = q.get("id", f"q_{idx}")
+            if q["type"] != "True_Or_False":
+                correct_sets[qid] = frozenset(
+                    str(i) for i in q["correct_choices"]
+                )
+        cached = (questions, correct_sets)
+        _READING_DERIVED['reading'] = cached
+
+    return questions, cached[1]
+
+# 克漏字空格的 pattern, 在 module 載入時編譯一次
+_BLANK_RE = re.compile(r'___\[(\d+)\]___')
+
+# cloze.json 的衍生資料快取, 以 _load_json 回傳的物件當 key
+# (檔案重寫後 _load_json 會給新物件, 舊的衍生資料自然失效)
+_CLOZE_DERIVED = {}
+
+def _load_cloze():
+    """
+    讀取 cloze.json, 並附上預先切好的 tokens 和答案對照表
+
+    tokens 是 _BLANK_RE.split(question) 的結果:
+    偶數位置是一般文字, 奇數位置是空格編號,
+    這樣每個 request 渲染時只要 join, 不用重跑 regex;
+    answers 是 {空格編號: 正解}, 對答案時直接查表
+    """
+    cloze_data = _load_json('data/cloze/cloze.json')
+
+    cached = _CLOZE_DERIVED.get('cloze')
+    if cached is None or cached[0] is not cloze_data:
+        tokens = _BLANK_RE.split(cloze_data["question"])
+        answers = {
+            str(item["idx"]): item["word"]
+            for item in cloze_data["ans"]
+        }
+        cached = (cloze_data, tokens, answers)
+        _CLOZE_DERIVED['cloze'] = cached
+
+    return cloze_data, cached[1], cached[2]
+
+# 整頁 HTML 快取: 輸出只由單一 JSON 檔決定的 GET 頁面,
+# 同一版檔案直接回上次 render 好的字串, 連 Jinja 都不用跑
+# (news_list / reading 會渲染 flash 訊息或 session 連結, 不能整頁快取)
+_RENDER_CACHE = {}
+_RENDER_CACHE_LOCK = threading.Lock()
+
+def _render_page_cached(key, path, render):
+    """
+    以 (key, 檔案 mtime) 快取整頁渲染結果
+
+    :param render: 快取失效時重新渲染頁面的函式
+    """
+    mtime = os.stat(path).st_mtime_ns
+
+    with _RENDER_CACHE_LOCK:
+        cached = _RENDER_CACHE.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    page = render()
+    with _RENDER_CACHE_LOCK:
+        _RENDER_CACHE[key] = (mtime, page)
+    return page
+
+# 使用者開文章頁的同時, 在背景先把心智圖和閱讀測驗生好,
+# 之後按按鈕時多半已經有現成檔案, 不用再等一次 LLM
+# 成品一篇一檔放在 data/pregen/, 按下按鈕才複製成 data/*.json,
+# 逛別篇文章不會動到正在作答的測驗
+_PREGEN_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+_PREGEN_PENDING = set()
+_PREGEN_LOCK = threading.Lock()
+
+os.makedirs('data/pregen', exist_ok=True)
+
+def _pregen_path(kind, category, article_id):
+    # 檔名綁上分類檔的 mtime, 重爬後同一個 id 是另一篇文章,
+    # 不會拿到上一批的舊成品
+    try:
+        version = os.stat(f"data/news/{category}.json").st_mtime_ns
+    except OSError:
+        version = 0
+    return f"data/pregen/{kind}_{category}_{article_id}_{version}.json"
+
+def _pregen_one(kind, article_key, article_text, output_path):
+    try:
+        service = _get_service()
+        if kind == "mindmap":
+            service.generate_mind_map(article_text, output_path=output_path)
+        else:
+            service.generate_reading_quiz(article_text, output_path=output_path)
+    except Exception:
+        logger.exception("background %s pre-generation failed", kind)
+    finally:
+        with _PREGEN_LOCK:
+            _PREGEN_PENDING.discard((kind, article_key))
+
+def _pregenerate_article(category, article_id, article_text):
+    """把這篇文章的心智圖 / 閱讀測驗丟到背景生成, 已經在做或做完就跳過"""
+    if not article_text:
+        return
+
+    article_key = (category, article_id)
+    for kind in ("mindmap", "reading"):
+        path = _pregen_path(kind, category, article_id)
+        if os.path.exists(path):
+            continue
+        with _PREGEN_LOCK:
+            if (kind, article_key) in _PREGEN_PENDING:
+                continue
+            _PREGEN_PENDING.add((kind, article_key))
+        _PREGEN_EXECUTOR.submit(_pregen_one, kind, article_key, article_text, path)
+
+def _use_pregen(kind, category, article_id, dest_path):
+    """有這篇文章的背景成品就複製到 dest_path, 回傳是否成功"""
+    src = _pregen_path(kind, category, article_id)
+    try:
+        shutil.copyfile(src, dest_path)
+        return True
+    except OSError:
+        return False
+
 # root directory
 @app.route('/')
 def index():
     return render_template('index.html')
+
+# data/ 只開放不含答案的成品: reading.json、cloze/cloze.json、
+# hangman/describe.txt 都是進行中測驗的解答, 不能整個目錄對外
+_PUBLIC_DATA_RE = re.compile(r"^(vocabulary/words\.json|mindMap\.json|news/[^/]+\.json)$")
+
+# send_from_directory 會附 ETag 並處理 If-None-Match,
+# 檔案沒變時瀏覽器重訪只拿到 304, 不用重傳內容
+@app.route('/data/<path:filename>')
+def data_file(filename):
+    if not _PUBLIC_DATA_RE.fullmatch(filename):
+        abort(404)
+    return send_from_directory('data', filename, max_age=3600, conditional=True)
     
 #--------------------------------------------------------------#
 #--------------------------------------------------------------#
@@ -32,7 +306,7 @@ def news():
     category = request.form.get('news_type')
     output_path = f"data/news/{category}.json"
 
-    service = EnglishLearningService()
+    service = _get_service()
     success = service.get_news_by_category(
         category=category,
         output_path=output_path
@@ -45,38 +319,32 @@ def news():
 
 @app.route('/news_list/<category>')
 def news_list(category):
-    news_path = f"data/news/{category}.json"
-
-    with open(news_path, 'r', encoding='utf-8') as f:
-        news_data = json.load(f)
+    _news_data, _by_id, list_view = _load_news(category)
 
     return render_template(
         'news_list.html',
         category=category,
-        articles=news_data["articles"]
+        articles=list_view
     )
 
 
 @app.route('/news_detail/<category>/<int:article_id>')
 def news_detail(category, article_id):
-    news_path = f"data/news/{category}.json"
-
-    with open(news_path, 'r', encoding='utf-8') as f:
-        news_data = json.load(f)
+    news_data, by_id, _list_view = _load_news(category)
 
     # find coresponding id article
-    article = next(
-        (a for a in news_data["articles"] if a["id"] == article_id),
-        None
-    )
+    article = by_id.get(article_id)
 
     if article is None:
         return "Article not found", 404
 
+    # session 只留 (category, id) 這組小 key,
+    # 文章全文和標題都能從快取的分類檔 O(1) 取回, 不用塞進 cookie 簽來簽去
     session['current_article_category'] = category
     session['current_article_id'] = article_id
-    #session['current_article_text'] = article['content']
-    session['current_article_title'] = article.get('title')
+
+    # 趁使用者讀文章時先在背景生成, 等等按按鈕就不用等
+    _pregenerate_article(category, article_id, article.get('content'))
 
     return render_template(
         'news_detail.html',
@@ -90,28 +358,21 @@ def news_detail(category, article_id):
 def generate_mindmap_route():
     category = session.get('current_article_category')
     article_id = session.get('current_article_id')
-    #article_text = session.get('current_article_text')
     
     if not category:
         flash('Invalid state of article, please re-choose category of news :<', 'warning')
         return redirect(url_for('index'))
 
-    news_path = f"data/news/{category}.json"
-
-    with open(news_path, 'r', encoding='utf-8') as f:
-        news_data = json.load(f)
+    news_data, by_id, _list_view = _load_news(category)
 
     # find coresponding id article
-    article = next(
-        (a for a in news_data["articles"] if a["id"] == article_id),
-        None
-    )
+    article = by_id.get(article_id)
 
     if article is None:
         return "Article not found", 404
 
     article_text = article['content']
-    
+
     if not article_id or not article_text:
         flash('Please goto news again to generate mindmap~', 'warning')
         return redirect(url_for('news_list', category=category))
@@ -121,8 +382,13 @@ def generate_mindmap_route():
        and os.path.exists('data/mindMap.json'):
         return redirect(url_for('mindmap'))
 
+    # 背景已經生好這篇的心智圖, 複製過來就好, 不用再等 LLM
+    if _use_pregen('mindmap', category, article_id, 'data/mindMap.json'):
+        session['mindmap_article_id'] = article_id
+        return redirect(url_for('mindmap'))
+
     try:
-        service = EnglishLearningService()
+        service = _get_service()
         service.generate_mind_map(
             article_text,
             output_path='data/mindMap.json'
@@ -138,13 +404,23 @@ def generate_mindmap_route():
 
 @app.route('/mindmap')
 def mindmap():
-    with open('data/mindMap.json', 'r', encoding='utf-8') as f:
-        mindmap_data = json.load(f)
+    path = 'data/mindMap.json'
 
-    return render_template(
-        'mindmap.html',
-        mindmap=mindmap_data
-    )
+    # 頁面內容只由檔案版本決定, 瀏覽器帶著同版 ETag 回來就回 304,
+    # 連渲染好的 HTML 都不用重傳
+    etag = f'W/"{os.stat(path).st_mtime_ns}"'
+    if request.headers.get('If-None-Match') == etag:
+        return '', 304
+
+    def render():
+        return render_template(
+            'mindmap.html',
+            mindmap=_load_json(path)
+        )
+
+    resp = make_response(_render_page_cached('mindmap', path, render))
+    resp.headers['ETag'] = etag
+    return resp
 
 #--------------------------------------------------------------#
 #--------------------------------------------------------------#
@@ -152,7 +428,6 @@ def mindmap():
 def generate_reading_route():
     category = session.get('current_article_category')
     article_id = session.get('current_article_id')
-    #article_text = session.get('current_article_text')
     
     if not category:
         flash('Invalid state of article, please re-choose category of news', 'warning')
@@ -163,22 +438,16 @@ def generate_reading_route():
         flash('Invalid state of article, please re-choose category of news :<', 'warning')
         return redirect(url_for('index'))
 
-    news_path = f"data/news/{category}.json"
-
-    with open(news_path, 'r', encoding='utf-8') as f:
-        news_data = json.load(f)
+    news_data, by_id, _list_view = _load_news(category)
 
     # find coresponding id article
-    article = next(
-        (a for a in news_data["articles"] if a["id"] == article_id),
-        None
-    )
+    article = by_id.get(article_id)
 
     if article is None:
         return "Article not found", 404
 
     article_text = article['content']
-    
+
     if not article_id or not article_text:
         flash('Please goto news again to generate reading test ~', 'warning')
         return redirect(url_for('news_list', category=category))
@@ -188,7 +457,12 @@ def generate_reading_route():
        and os.path.exists('data/reading.json'):
         return redirect(url_for('reading'))
 
-    service = EnglishLearningService()
+    # 背景已經生好這篇的閱讀測驗, 複製過來就好, 不用再等 LLM
+    if _use_pregen('reading', category, article_id, 'data/reading.json'):
+        session['reading_article_id'] = article_id
+        return redirect(url_for('reading'))
+
+    service = _get_service()
     service.generate_reading_quiz(
         article_text,
         output_path='data/reading.json'
@@ -198,8 +472,7 @@ def generate_reading_route():
 
 @app.route('/reading', methods=['GET'])
 def reading():
-    with open('data/reading.json', 'r', encoding='utf-8') as f:
-        questions = json.load(f)
+    questions, _correct_sets = _load_reading()
 
     return render_template(
         'reading.html',
@@ -209,48 +482,41 @@ def reading():
 
 @app.route('/submit_reading', methods=['POST'])
 def submit_reading():
-    with open('data/reading.json', 'r', encoding='utf-8') as f:
-        questions = json.load(f)
-        
-    for idx, q in enumerate(questions):
-        qid = q.get("id", f"q_{idx}")
+    questions, correct_sets = _load_reading()
 
-        if q["type"] == "True_Or_False":
-            if request.form.get(qid) is None:
-                return redirect(url_for('reading'))
-
-        else:  # Multiple_Answer
-            if not request.form.getlist(qid):
-                return redirect(url_for('reading'))
 
     result = {}
+
+    # 單一迴圈同時檢查漏答和對答案, 有漏答就整份退回重寫
     for idx, q in enumerate(questions):
         qid = q.get("id", f"q_{idx}")
 
         if q["type"] == "True_Or_False":
             user_answer = request.form.get(qid)
-            correct = str(q["answer"]).lower()
+            if user_answer is None:
+                return redirect(url_for('reading'))
 
-            is_correct = (user_answer == correct)
+            correct = str(q["answer"]).lower()
 
             result[qid] = {
                 "type": q["type"],
                 "user": user_answer,
-                "is_correct": is_correct,
+                "is_correct": user_answer == correct,
                 "explanation": q["explanation"]
             }
 
         else:  # Multiple_Answer
             user_choices = request.form.getlist(qid)
-            correct_choices = [str(i) for i in q["correct_choices"]]
+            if not user_choices:
+                return redirect(url_for('reading'))
 
-            is_correct = sorted(user_choices) == sorted(correct_choices)
+            correct_choices = [str(i) for i in q["correct_choices"]]
 
             result[qid] = {
                 "type": q["type"],
                 "user": user_choices,
                 "correct": correct_choices,
-                "is_correct": is_correct,
+                "is_correct": frozenset(user_choices) == correct_sets[qid],
                 "explanation": q["explanation"]
             }
 
@@ -267,21 +533,20 @@ def submit_reading():
 @app.route('/start_learn', methods=['POST'])
 def start_learn():
     category = request.form.get('category')
-    article_id = int(request.form.get('article_id'))
+    article_id = _form_int('article_id')
     cefr = request.form.get('cefr')
-    count = int(request.form.get('count'))
-    session['cefr'] = request.form.get('cefr')
-    session['count'] = int(request.form.get('count'))
+    count = _form_int('count')
+
+    if article_id is None or count is None:
+        return "Invalid form input", 400
+
+    session['cefr'] = cefr
+    session['count'] = count
 
     # read news file
-    news_path = f"data/news/{category}.json"
-    with open(news_path, 'r', encoding='utf-8') as f:
-        news_data = json.load(f)
+    news_data, by_id, _list_view = _load_news(category)
 
-    article = next(
-        (a for a in news_data["articles"] if a["id"] == article_id),
-        None
-    )
+    article = by_id.get(article_id)
 
     if article is None:
         return "Article not found", 404
@@ -291,7 +556,7 @@ def start_learn():
         return "Article content missing", 500
 
     # call LLM produce vocabulary
-    service = EnglishLearningService()
+    service = _get_service()
 
     vocab_path = "data/vocabulary/words.json"
 
@@ -315,14 +580,8 @@ def learn():
     level = session.get('cefr')
     count = session.get('count')
 
-    # the file received
-    json_path = os.path.join('data/vocabulary', 'words.json')
-
-    with open(json_path, 'r', encoding='utf-8') as f:
-        words = json.load(f)
-
-    # choose the number of voc 
-    selected = words[:count]
+    # choose the number of voc
+    selected = _load_words(count)
 
     return render_template(
         'vocabulary.html', 
@@ -341,9 +600,12 @@ def check_sentence():
     word = request.form.get('word')
     sentence = request.form.get('sentence')
     level = request.form.get('level')
-    count = int(request.form.get('count'))
+    count = _form_int('count')
+
+    if count is None:
+        return "Invalid form input", 400
 
-    service = EnglishLearningService()
+    service = _get_service()
     result_path = "data/vocabulary/sentence_feedback.json"
     success = service.check_vocabulary_usage(
         word_list=[word],
@@ -355,8 +617,7 @@ def check_sentence():
         return "LLM sentence check failed", 500
     
     # read LLM feedback
-    with open(result_path, 'r', encoding='utf-8') as f:
-        resp = json.load(f)
+    resp = _load_json(result_path)
 
     feedback_result = {
         "word": word,
@@ -366,11 +627,7 @@ def check_sentence():
     }
 
     # load vocabulary
-    json_path = os.path.join('data/vocabulary', 'words.json')
-    with open(json_path, 'r', encoding='utf-8') as f:
-        all_words = json.load(f)
-
-    words = all_words[:count]
+    words = _load_words(count)
 
     # not redirect, add anchor
     return render_template(
@@ -381,15 +638,58 @@ def check_sentence():
         anchor=word   # use for scroll 
     )
 
+# 一次批改多個 (word, sentence), 整批只打一次 LLM,
+# 省掉逐句送出的 N-1 次網路往返
+@app.route('/check_sentences_bulk', methods=['POST'])
+def check_sentences_bulk():
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "invalid input"}), 400
+
+    word_list = []
+    sentences = []
+    for item in items:
+        word = (item.get('word') or '').strip()
+        sentence = (item.get('sentence') or '').strip()
+        if not word or not sentence:
+            return jsonify({"error": "invalid input"}), 400
+        word_list.append(word)
+        sentences.append(sentence)
+
+    service = _get_service()
+    result_path = "data/vocabulary/sentence_feedback.json"
+    success = service.check_vocabulary_usage(
+        word_list=word_list,
+        sentences=sentences,
+        output_path=result_path
+    )
+
+    if success is not True:
+        return jsonify({"error": "LLM sentence check failed"}), 500
+
+    resp = _load_json(result_path)
+
+    feedback = [
+        {
+            "word": word,
+            "user_sentence": sentence,
+            "is_correct": r.get("is_correct"),
+            "explanation": r.get("explanation")
+        }
+        for word, sentence, r in zip(word_list, sentences, resp)
+    ]
+
+    return jsonify({"feedback": feedback})
+
 #--------------------------------------------------------------#
 #--------------------------------------------------------------#
 
-# Cloze 
+# Cloze
 @app.route('/cloze', methods=['GET'])
 def cloze():
     # read voc
-    with open('data/vocabulary/words.json', 'r', encoding='utf-8') as f:
-        words = json.load(f)
+    words = _load_words()
 
     return render_template(
         'cloze.html',
@@ -403,8 +703,7 @@ def cloze_select():
 
     # if user choose less than 2
     if len(selected_words) < 2:
-        with open('data/vocabulary/words.json', 'r', encoding='utf-8') as f:
-            words = json.load(f)
+        words = _load_words()
 
         return render_template(
             'cloze.html',
@@ -413,12 +712,11 @@ def cloze_select():
             error="Please select at least TWO words to start the cloze test."
         )
 
-    data = [{"word": w} for w in selected_words]
+    # 選字只屬於這個使用者, 存 session 就好,
+    # 寫共用檔案會讓同時玩的使用者互相蓋掉對方的選字
+    session['cloze_input'] = [{"word": w} for w in selected_words]
 
-    with open('data/cloze/input.json', 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-    service = EnglishLearningService();
+    service = _get_service()
     level = session.get('cefr')
     output_path = "data/cloze/cloze.json"
     success = service.generate_cloze_test(
@@ -436,25 +734,14 @@ def cloze_select():
 @app.route('/cloze_play', methods=['GET'])
 def cloze_play():
     # read cloze json
-    with open('data/cloze/cloze.json', 'r', encoding='utf-8') as f:
-        cloze_data = json.load(f)
-
-    text = cloze_data["question"]
-
-    # read input.json
-    with open('data/cloze/input.json', 'r', encoding='utf-8') as f:
-        selected_words = json.load(f)
+    cloze_data, tokens, _answers = _load_cloze()
 
-    def replace_blank(match):
-        idx = match.group(1)
-        return f'<input type="text" name="blank_{idx}" style="width:120px;">'
-
-    html_text = re.sub(r'___\[(\d+)\]___', replace_blank, text)
+    selected_words = session.get('cloze_input', [])
 
     return render_template(
         'cloze.html',
         stage="play",
-        cloze_text=html_text,
+        cloze_tokens=tokens,
         selected_words=selected_words,
         result=None
     )
@@ -462,71 +749,40 @@ def cloze_play():
 @app.route('/submit_cloze', methods=['POST'])
 def submit_cloze():
     # read cloze json
-    with open('data/cloze/cloze.json', 'r', encoding='utf-8') as f:
-        cloze_data = json.load(f)
-
-    text = cloze_data["question"]
-
-    # turn ans list into dict: { "1": "reaction", ... }
-    answers = {
-        str(item["idx"]): item["word"]
-        for item in cloze_data["ans"]
-    }
+    cloze_data, tokens, answers = _load_cloze()
 
     # read voc chosen by user
-    with open('data/cloze/input.json', 'r', encoding='utf-8') as f:
-        selected_words = json.load(f)
+    selected_words = session.get('cloze_input', [])
 
     used_words = set(request.form.getlist('used_word'))
+    locked_words = set()
 
     result = {}
 
+    # 單一迴圈做完: 對答案、收集用過的單字、收集要鎖住的單字
     for key, value in request.form.items():
-        idx = key.replace('blank_', '')
+        # 表單裡還有 used_word 等欄位, 只處理 blank_ 開頭的,
+        # 用切片而不是 replace, 避免誤砍到欄位名稱中間的字
+        if not key.startswith('blank_'):
+            continue
+        idx = key[len('blank_'):]
         user = value.strip()
         correct = answers.get(idx, "")
 
-        is_correct = user.lower() == correct.lower()
+        is_correct = user.casefold() == correct.casefold()
         result[idx] = {
             "user": user,
             "correct": correct,
-            "is_correct": user.lower() == correct.lower()
+            "is_correct": is_correct
         }
         if is_correct and correct:
             used_words.add(correct)
-
-    def replace_blank(match):
-        idx = match.group(1)
-        r = result.get(idx)
-
-        if not r:
-            return f'<input type="text" name="blank_{idx}" style="width:120px;">'
-
-        # if correct，add readonly attribute and correct type
-        if r["is_correct"]:
-            return f'<input type="text" name="blank_{idx}" value="{r["user"]}" readonly class="cloze-input correct">'
-        else:
-            return f'<input type="text" name="blank_{idx}" value="{r["user"]}" class="cloze-input error">'
-
-        color = "#c8f7c5" if r["is_correct"] else "#f7c5c5"
-        readonly = "readonly" if r["is_correct"] else ""
-        return f'''
-        <input type="text"
-               name="blank_{idx}"
-               value="{r['user']}"
-               {readonly}
-               style="width:120px; background-color:{color};">
-        '''
-    locked_words = {
-        r["correct"] for r in result.values() if r["is_correct"]
-    }
-
-    html_text = re.sub(r'___\[(\d+)\]___', replace_blank, text)
+            locked_words.add(correct)
 
     return render_template(
         'cloze.html',
         stage="play",
-        cloze_text=html_text,
+        cloze_tokens=tokens,
         selected_words=selected_words,
         used_words=list(used_words),
         locked_words=locked_words,
@@ -536,29 +792,68 @@ def submit_cloze():
 #--------------------------------------------------------------#
 #--------------------------------------------------------------#
 ## Hangman Game ###
+
+# 遊戲狀態放在 server 端, cookie 只留一個短 id,
+# 免得每按一個字母都要把整包狀態簽章送去送回
+_HANGMAN_STATE = {}
+_HANGMAN_STATE_LOCK = threading.Lock()
+
+# a-z 對應到 26-bit mask, 查不到就代表不是合法輸入
+# 猜過的字母和答案字母都用整數 mask 表示, 檢查 membership 只要一個 bitwise and
+_LETTER_BIT = {c: 1 << (ord(c) - 97) for c in "abcdefghijklmnopqrstuvwxyz"}
+
+def _get_hangman_state():
+    """取出目前 session 對應的 hangman 狀態, 沒有進行中的遊戲回傳 None"""
+    sid = session.get("hangman_sid")
+    if sid is None:
+        return None
+    with _HANGMAN_STATE_LOCK:
+        return _HANGMAN_STATE.get(sid)
+
 @app.route('/hangman', methods=['GET'])
 def hangman():
     # read vocabulary
-    with open('data/vocabulary/words.json', 'r', encoding='utf-8') as f:
-        words = json.load(f)
+    words = _load_words()
 
     answer = random.choice(words)["word"].lower()
 
-    session["hangman_answer"] = answer
-    session["hangman_guessed"] = []
-    session["hangman_wrong"] = 0
-    session["hangman_hint_used"] = False
+    # 開新遊戲: 清掉舊的狀態, 配一個新 id
+    old_sid = session.pop("hangman_sid", None)
+    sid = secrets.token_urlsafe(8)
+    with _HANGMAN_STATE_LOCK:
+        _HANGMAN_STATE.pop(old_sid, None)
+        answer_mask = 0
+        for c in answer:
+            answer_mask |= _LETTER_BIT.get(c, 0)
+
+        _HANGMAN_STATE[sid] = {
+            "answer": answer,
+            "answer_mask": answer_mask,
+            "guessed": [],      # 照猜測順序, 顯示用
+            "guessed_mask": 0,
+            "wrong": 0,
+            "hint_used": False,
+            "hint_text": None,
+        }
+    session["hangman_sid"] = sid
 
-    service = EnglishLearningService()
+    service = _get_service()
 
     level = session.get('cefr')
     output_path = "data/hangman/describe.txt"
-    service.generate_hangman_hint(
+    ok = service.generate_hangman_hint(
         word=answer,
         CEFR=level,
         output_path=output_path
     )
 
+    # 提示生成好就直接收進遊戲狀態, 之後按提示鈕完全不用碰磁碟
+    if ok is True:
+        with _HANGMAN_STATE_LOCK:
+            state = _HANGMAN_STATE.get(sid)
+            if state is not None:
+                state["hint_text"] = _load_text(output_path)
+
     masked = " ".join("_" for _ in answer)
 
     return render_template(
@@ -573,33 +868,41 @@ def hangman():
 
 @app.route('/hangman_guess_ajax', methods=['POST'])
 def hangman_guess_ajax():
-    data = request.json
+    # silent=True: 壞掉的 JSON 直接當空 dict, 不讓 Flask 丟 400 例外
+    data = request.get_json(silent=True) or {}
     letter = data.get("letter", "").lower()
 
-    answer = session.get("hangman_answer")
-    guessed = session.get("hangman_guessed", [])
-    wrong = session.get("hangman_wrong", 0)
+    state = _get_hangman_state()
+    if state is None:
+        return jsonify({"error": "no active game"})
 
-    if not letter or len(letter) != 1 or not letter.isalpha():
+    # 查不到 bit 就不是單一個 a-z 字母, 一次 lookup 做完所有輸入驗證
+    bit = _LETTER_BIT.get(letter)
+    if bit is None:
         return jsonify({"error": "invalid input"})
 
-    if letter not in guessed:
-        guessed.append(letter)
-        if letter not in answer:
-            wrong += 1
+    answer = state["answer"]
+    wrong = state["wrong"]
 
-    session["hangman_guessed"] = guessed
-    session["hangman_wrong"] = wrong
-    
+    if not (state["guessed_mask"] & bit):
+        state["guessed_mask"] |= bit
+        state["guessed"].append(letter)
+        if not (state["answer_mask"] & bit):
+            wrong += 1
+            state["wrong"] = wrong
 
-    masked = " ".join(c if c in guessed else "_" for c in answer)
+    guessed_mask = state["guessed_mask"]
+    masked = " ".join(
+        c if guessed_mask & _LETTER_BIT.get(c, 0) else "_" for c in answer
+    )
 
-    win = "_" not in masked
+    # 答案的字母都猜到了就贏, 一個整數運算就能判斷
+    win = (state["answer_mask"] & ~guessed_mask) == 0
     lose = wrong >= 6
 
     return jsonify({
         "masked": masked,
-        "guessed": guessed,
+        "guessed": state["guessed"],
         "wrong": wrong,
         "win": win,
         "lose": lose,
@@ -609,30 +912,35 @@ def hangman_guess_ajax():
 
 @app.route('/hangman_hint', methods=['POST'])
 def hangman_hint():
+    state = _get_hangman_state()
+    if state is None:
+        return jsonify({"error": "no active game"})
+
     # The user had used the hint
-    if session.get("hangman_hint_used"):
+    if state["hint_used"]:
         return jsonify({
             "error": "hint_used",
-            "wrong": session.get("hangman_wrong", 0)
+            "wrong": state["wrong"]
         })
 
     # noted as used
-    session["hangman_hint_used"] = True
+    state["hint_used"] = True
 
     # minus one life
-    wrong = session.get("hangman_wrong", 0) + 1
-    session["hangman_wrong"] = wrong
+    wrong = state["wrong"] + 1
+    state["wrong"] = wrong
+
+    # 正常情況提示已經在遊戲狀態裡, 沒有的話才退回去讀檔
+    hint_text = state.get("hint_text")
+    if hint_text is None:
+        hint_path = 'data/hangman/describe.txt'
+        if not os.path.exists(hint_path):
+            return jsonify({
+                "error": "hint_not_ready",
+                "wrong": wrong
+            })
+        hint_text = _load_text(hint_path)
 
-    hint_path = 'data/hangman/describe.txt'
-    if not os.path.exists(hint_path):
-        return jsonify({
-            "error": "hint_not_ready",
-            "wrong": wrong
-        })
-    with open(hint_path, 'r', encoding='utf-8') as f:
-        hint_text = f.read()
-    
-    
     lose = wrong >= 6
 
     return jsonify({
@@ -7,7 +7,10 @@ class EnglishLearning:
     功能:
         - 依指定單字在文章中挖空, 產生克漏字題目, 並檢查作答是否正確
     """
-    
+
+    # 要匹配的單字格式, 在 class 載入時編譯一次
+    WORD_RE = re.compile(r"\b[a-zA-Z]+\b")
+
     def __init__(self):
         pass
 
@@ -17,42 +20,24 @@ class EnglishLearning:
 
         :return: (挖空後的新文章, 答案 list)
         """
-        # 要匹配的單字格式不分大小寫
-        pattern = re.compile(r"\b[a-zA-Z]+\b")
-        target_set = {w.lower() for w in words}
+        # 要匹配的單字不分大小寫
+        target_set = frozenset(w.lower() for w in words)
 
         ans_list = []
-        replace_span = []
-        idx = 1
 
-        for match_word in pattern.finditer(text):
+        # 用 re.sub 的 callback 一趟掃完:
+        # 不在清單裡的單字原樣放回, 在清單裡的換成填空並記下答案
+        def replace(match_word):
             word = match_word.group(0)
-            ans = word.lower()
-            # 如果找到的單字不在指定單字清單中, 跳過
-            if ans not in target_set:
-                continue
+            if word.lower() not in target_set:
+                return word
+            idx = len(ans_list) + 1
             ans_list.append({'idx': idx, 'word': word})
-            replace_span.append((match_word.start(), match_word.end(), idx))
-            idx += 1
-        
-        new_text_parts = []
-        pos = 0
-        for start, end, i in replace_span:
-            # 替換的單字前面的文字加進去
-            if pos < start:
-                new_text_parts.append(text[pos:start])
-
-            # 把單字替換成填空
-            new_text_parts.append(f"___[{i}]___")
-            pos = end
-            
-        # 最後一個替換的單字後面的文字加進去
-        if pos < len(text):
-            new_text_parts.append(text[pos:])
-
-        new_text_parts = "".join(new_text_parts)
+            return f"___[{idx}]___"
+
+        new_text = self.WORD_RE.sub(replace, text)
 
         return {
-            "question": new_text_parts, 
+            "question": new_text,
             "ans": ans_list
-        }
\ No newline at end of file
+        }
@@ -1,4 +1,4 @@
-import logging, json
+import logging, orjson, os, time
 
 from news_crawler import BBCNewsCrawler
 from agent import Agent
@@ -12,19 +12,32 @@ class EnglishLearningService:
     整合 BBCNewsCrawler、Agent、EnglishLearning, 對外提供一組乾淨的後端服務 API。
     """
 
+    # 同一分類在這段時間內不重爬, BBC 首頁不會每分鐘換內容
+    NEWS_TTL_SECONDS = 600
+
     def __init__(self):
         self.crawler = BBCNewsCrawler()
         self.agent = Agent(timeout=120)
         self.english_learning = EnglishLearning()
+        self._news_fetched_at = {}
 
     @staticmethod
-    def _save_db(data, write_path):
+    def _save_json(data, write_path):
+        with open(write_path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+    @staticmethod
+    def _save_text(data, write_path):
+        # 純文字輸出 (hangman 提示等) 直接寫檔, 不經過 JSON 序列化
         with open(write_path, "w", encoding="utf-8") as f:
-            if isinstance(data, (dict, list)):
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            else:
-                f.write(str(data))
-        f.close()
+            f.write(str(data))
+
+    @staticmethod
+    def _save_db(data, write_path):
+        if isinstance(data, (dict, list)):
+            EnglishLearningService._save_json(data, write_path)
+        else:
+            EnglishLearningService._save_text(data, write_path)
 
     # ---------- 1. BBC 新聞相關 API ----------
     def get_news_by_category(self, category, output_path = None):
@@ -39,6 +52,15 @@ class EnglishLearningService:
                 logger.warning("get_news_by_category() got empty category")
                 return None
 
+            # 剛爬過而且檔案還在, 直接視為成功, 不重打 BBC
+            fetched_at = self._news_fetched_at.get(category)
+            if (output_path is not None
+                    and fetched_at is not None
+                    and time.monotonic() - fetched_at < self.NEWS_TTL_SECONDS
+                    and os.path.exists(output_path)):
+                logger.info("news for %s is still fresh, skip recrawl", category)
+                return True
+
             news = self.crawler.get_articles_by_category(category)
             if news is None:
                 logger.error("crawler.get_articles_by_category() returned None")
@@ -58,8 +80,9 @@ class EnglishLearningService:
                 return False
             else:
                 self._save_db(news, output_path)
+                self._news_fetched_at[category] = time.monotonic()
                 return True
-            
+
         except Exception:
             logger.exception("get_news_by_category(%r) failed", category)
             return None
@@ -93,6 +116,7 @@ class EnglishLearningService:
                 prompt,
                 stream=False,
                 parse_json=True,
+                validator=self.agent.validate_news_voc,
             )
 
             # 檢查回傳結果
@@ -116,6 +140,47 @@ class EnglishLearningService:
             logger.exception("get_vocabulary_from_news() failed")
             return None
 
+    def generate_article_bundle(self, article_content, CEFR, n_words,
+                                voc_path = None, mind_map_path = None, reading_path = None):
+        """
+        用一次 LLM 呼叫, 同時產生單字表、心智圖、閱讀測驗並存檔
+
+        文章只需要上傳一次, 比三個功能各自呼叫少兩次網路往返
+
+        :param article_content: 文章全文（純文字）
+        :param CEFR: CEFR 等級, e.g., "B1"
+        :param n_words: 要整理幾個單字
+        :return: 存到資料庫成功, 回傳 True, 反之回傳 False, 若資料有誤則回傳 None
+        """
+        if not article_content or not article_content.strip():
+            logger.warning("article_content is empty, skip calling LLM")
+            return None
+
+        try:
+            bundle = self.agent.analyze_article(article_content, CEFR, n_words)
+            if bundle is None:
+                logger.error("LLM returned None when generating article bundle")
+                return None
+
+            voc, mind_map, reading_quiz = bundle
+
+            # 資料存檔
+            if voc_path is None and mind_map_path is None and reading_path is None:
+                logger.info("There is no output_path")
+                return False
+
+            if voc_path is not None:
+                self._save_db(voc, voc_path)
+            if mind_map_path is not None:
+                self._save_db(mind_map, mind_map_path)
+            if reading_path is not None:
+                self._save_db(reading_quiz, reading_path)
+            return True
+
+        except Exception:
+            logger.exception("generate_article_bundle() failed")
+            return None
+
     # ---------- 2. 檢查單字用法 API ----------
     def check_vocabulary_usage(self, word_list, sentences, output_path = None):
         """
@@ -149,6 +214,7 @@ class EnglishLearningService:
                 prompt,
                 stream=False,
                 parse_json=True,
+                validator=self.agent.validate_check_voc,
             )
             if resp is None:
                 logger.error("API response is None in check_vocabulary_usage()")
@@ -245,9 +311,9 @@ class EnglishLearningService:
                 logger.info("There is no output_path")
                 return False
             else:
-                self._save_db(resp, output_path)
+                self._save_text(resp, output_path)
                 return True
-            
+
         except Exception:
             logger.exception("generate_hangman_hint() failed")
             return None
@@ -274,6 +340,7 @@ class EnglishLearningService:
                 prompt,
                 stream=False,
                 parse_json=True,
+                validator=self.agent.validate_mind_map,
             )
             if resp is None:
                 logger.error("LLM returned None in generate_mind_map()")
@@ -317,6 +384,7 @@ class EnglishLearningService:
                 prompt,
                 stream=False,
                 parse_json=True,
+                validator=self.agent.validate_reading_quiz,
             )
             if resp is None:
                 logger.error("LLM returned None in generate_reading_quiz()")
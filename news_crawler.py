@@ -1,9 +1,23 @@
-import requests, random, logging
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+import re, os, gzip, time, orjson, hashlib, threading, requests, random, logging
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+from urllib.parse import urljoin
 
 logger = logging.getLogger(__name__)
 
+# 影片 / live 連結的 pattern, 在 module 載入時編譯一次
+_USELESS_RE = re.compile(r"/(videos|live)/")
+
+# lxml 是 C 實作的 parser, 解析 BBC 頁面比內建 html.parser 快好幾倍,
+# 沒安裝的環境就退回 html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
 class BBCNewsCrawler:
     """
     用來爬取 BBC 不同類別的新聞
@@ -35,13 +49,188 @@ class BBCNewsCrawler:
         "sport":         ("sport",         "sport"),
     }
 
-    def __init__(self, timeout = 10):
+    # parse_only 讓 parser 只建需要的子樹,
+    # nav / footer / <script> (BBC 塞很大的 JSON-LD) 根本不會進 DOM
+    GRID_STRAINER = SoupStrainer(
+        "div", attrs={"data-testid": list(STYLE_SECTION_ID.values())}
+    )
+    # class_ 給字串是整串比對, BBC 的 grid <ul> 有多個 class,
+    # 要用 callable 逐一比對 class 值才抓得到
+    SPORT_STRAINER = SoupStrainer(
+        "ul", class_=lambda v: v is not None and "ssrcss-uy86gw-Grid" in v.split()
+    )
+    # 文章頁要留 h1 (標題) 和 div/p (內文和它的 data-component 祖先)
+    ARTICLE_STRAINER = SoupStrainer(["h1", "div", "p"])
+
+    # style -> 對應分類頁的 strainer, class 載入時建好查表就好
+    STYLE_STRAINER = {
+        "news_style": GRID_STRAINER,
+        "culture_style": GRID_STRAINER,
+        "sport": SPORT_STRAINER,
+    }
+
+    # 單頁最多讀這麼多 bytes, 文章本文都在前面,
+    # 再後面多是廣告跟追蹤用的資料, 不值得下載和解析
+    MAX_BODY_BYTES = 512 * 1024
+
+    def __init__(self, timeout = 10, cache_dir = None, cache_ttl = 3600,
+                 min_interval = 0.1, checkpoint_dir = None):
         """
         初始化 BBCNewsCrawler
 
         :param timeout: requests timeout (秒)
+        :param cache_dir: 頁面磁碟快取目錄, None 表示不啟用 (開發重跑時很省)
+        :param cache_ttl: 快取有效秒數
+        :param min_interval: 兩次實際送出請求之間的最小間隔 (秒), 0 表示不限
+        :param checkpoint_dir: 逐篇進度檔目錄, None 表示不啟用,
+                               啟用後中斷重跑會跳過已完成的文章
         """
         self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self.min_interval = min_interval
+        self.checkpoint_dir = checkpoint_dir
+        self._rate_lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._next_request_time = 0.0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+        # 所有請求都打同一個 host, 共用 Session 讓 keep-alive 生效,
+        # 每篇文章就不用重新做一次 TCP + TLS 握手
+        # pool_maxsize 要 >= thread pool 的 worker 數, 執行緒才不會搶連線
+        # 暫時性的 5xx / 429 / 連線被重置, 自動退避重試,
+        # 免得一次網路抖動就掉一整篇文章; Retry-After header 會被尊重
+        retry = Retry(
+            total=3,
+            backoff_factor=1.0,
+            status_forcelist=[429, 500, 502, 503, 504],
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32,
+                              max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "User-Agent": (
+                "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+                "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+            ),
+            "Accept-Encoding": "gzip, deflate",
+        })
+
+    def _cache_path(self, url):
+        """
+        以 URL 的 sha1 當檔名, 回傳該頁面在磁碟快取中的路徑
+        """
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.html.gz")
+
+    def _cache_get(self, url):
+        """
+        讀取磁碟快取的頁面 bytes, 沒有或過期回傳 None
+        """
+        path = self._cache_path(url)
+        try:
+            if time.time() - os.path.getmtime(path) < self.cache_ttl:
+                with gzip.open(path, "rb") as f:
+                    return f.read()
+        except OSError:
+            pass
+        return None
+
+    def _cache_put(self, url, body):
+        """
+        把頁面 bytes 壓縮後寫進磁碟快取
+        """
+        try:
+            with gzip.open(self._cache_path(url), "wb") as f:
+                f.write(body)
+        except OSError:
+            logger.warning(f"fail to write page cache for {url}")
+
+    def _throttle(self):
+        """
+        限制實際打到 BBC 的請求頻率
+
+        每個請求在鎖裡預約自己的發車時間, 多執行緒同時抓
+        也只會以 min_interval 的節奏送出, 不會瞬間打爆人家
+        """
+        if self.min_interval <= 0:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) \
+                + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def _load_checkpoint(self, name):
+        """
+        讀取某分類的 checkpoint
+
+        :param name: 分類名稱
+        :return: {link: (title, content)}, 沒啟用或沒有檔案回傳空 dict
+        """
+        done = {}
+        if not self.checkpoint_dir:
+            return done
+
+        path = os.path.join(self.checkpoint_dir, f"{name}.jsonl")
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = orjson.loads(line)
+                        done[rec["link"]] = (rec["title"], rec["content"])
+                    except (orjson.JSONDecodeError, KeyError):
+                        continue
+        except OSError:
+            pass
+        return done
+
+    def _append_checkpoint(self, name, link, title, content):
+        """
+        把一篇抓完的文章補寫進分類的 checkpoint 檔
+        """
+        if not self.checkpoint_dir:
+            return
+
+        path = os.path.join(self.checkpoint_dir, f"{name}.jsonl")
+        rec = {"link": link, "title": title, "content": content}
+        try:
+            with self._checkpoint_lock:
+                with open(path, "ab") as f:
+                    f.write(orjson.dumps(rec) + b"\n")
+        except OSError:
+            logger.warning(f"fail to append checkpoint for {link}")
+
+    def clear_cache(self):
+        """清掉磁碟上所有的頁面快取"""
+        if not self.cache_dir:
+            return
+        try:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".html.gz"):
+                    os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            logger.exception("fail to clear page cache")
+
+    def close(self):
+        """關閉底層連線池"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _build_url(self, path):
         """
@@ -52,20 +241,37 @@ class BBCNewsCrawler:
         """
         return f"{self.BASE_URL}/{path}"
 
-    def _get_soup(self, url):
+    def _get_soup(self, url, strainer=None):
         """
         對指定 URL 發送 GET 請求並回傳 BeautifulSoup 物件
-        
+
         :param url: 爬取的連結
+        :param strainer: SoupStrainer, 只解析頁面中需要的子樹
         :return: 解析後的 BeautifulSoup 物件, 若請求失敗則回傳 None
         """
+        if self.cache_dir:
+            body = self._cache_get(url)
+            if body is not None:
+                return BeautifulSoup(body, HTML_PARSER, parse_only=strainer)
+
+        self._throttle()
+
         try:
-            resp = requests.get(url, timeout=self.timeout)
-            resp.raise_for_status()
+            resp = self.session.get(url, timeout=self.timeout, stream=True)
+            try:
+                resp.raise_for_status()
+                body = resp.raw.read(self.MAX_BODY_BYTES, decode_content=True)
+            finally:
+                resp.close()
         except requests.RequestException:
             logger.exception(f"Request failed: {url}" )
             return None
-        return BeautifulSoup(resp.text, "html.parser")
+
+        if self.cache_dir:
+            self._cache_put(url, body)
+
+        # 直接餵 bytes, 讓 parser 自己偵測編碼, 省掉 resp.text 的解碼
+        return BeautifulSoup(body, HTML_PARSER, parse_only=strainer)
 
     def _is_useless_url(self, url):
         """
@@ -74,8 +280,8 @@ class BBCNewsCrawler:
         :param url: 要判斷的 URL
         :return: 若為影片或 live 連結則回傳 True, 否則回傳 False
         """
-        path = urlparse(url).path
-        return "/videos/" in path or "/live/" in path
+        # 直接掃原始 URL, 省掉每個連結一次 urlparse 的物件配置
+        return bool(_USELESS_RE.search(url))
     
     def _find_section(self, soup, section_testid):
         """
@@ -93,19 +299,21 @@ class BBCNewsCrawler:
         並過濾掉影片和live 連結
 
         :param section: 頁面中代表文章區的 <div> 區塊
-        :return: 一組 (set) 整理好的完整文章 URL
+        :return: 按頁面出現順序排列且去重的完整文章 URL list
         """
-        links = set()
+        links = []
+        seen = set()
 
         for a in section.find_all("a", href=True):
             if a.get("data-testid") != "internal-link":
                 continue
 
             full_url = urljoin(self.BASE_URL, a["href"])
-            if self._is_useless_url(full_url):
+            if self._is_useless_url(full_url) or full_url in seen:
                 continue
 
-            links.add(full_url)
+            seen.add(full_url)
+            links.append(full_url)
 
         return links
 
@@ -115,7 +323,7 @@ class BBCNewsCrawler:
 
         :param soup: 分類頁面的 BeautifulSoup 物件
         :param style: 分類頁的類型 (news_style 或 culture_style)
-        :return: 一組文章 URL, 若找不到對應 section 則回傳空集合
+        :return: 按頁面順序排列的文章 URL list, 若找不到對應 section 則回傳空 list
         """
         section_id = self.STYLE_SECTION_ID.get(style)
         if not section_id:
@@ -124,7 +332,7 @@ class BBCNewsCrawler:
         section = self._find_section(soup, section_id)
         if section is None:
             logger.warning(f"Section not found: data-testid={section_id}")
-            return set()
+            return []
 
         return self._extract_internal_links(section)
     
@@ -133,16 +341,17 @@ class BBCNewsCrawler:
         解析 sport 類型的分類頁, 抓出 sport 類文章連結
 
         :param soup: sport 分類頁的 BeautifulSoup 物件
-        :return: 一組文章 URL, 若找不到則回傳空的 set
+        :return: 按頁面順序排列且去重的文章 URL list, 若找不到則回傳空 list
         """
-        links = set()
+        links = []
+        seen = set()
 
         # 限定要抓的範圍
         container = soup.select_one("ul.ssrcss-uy86gw-Grid.e12imr580")
         if container is None:
             logger.warning("Sport grid container not found")
             return links
-        
+
         # 在 container 裡找連結
         promos = container.select('div[data-testid="promo"][type="article"]')
 
@@ -152,9 +361,11 @@ class BBCNewsCrawler:
                 continue
 
             full_url = urljoin(self.BASE_URL, a["href"])
-            if self._is_useless_url(full_url):
+            if self._is_useless_url(full_url) or full_url in seen:
                 continue
-            links.add(full_url)
+
+            seen.add(full_url)
+            links.append(full_url)
 
         return links
 
@@ -163,16 +374,17 @@ class BBCNewsCrawler:
         根據傳入的新聞分類名稱, 抓取該分類首頁上的所有文章連結
 
         :param name: 分類名稱必須是 CATEGORY_CONFIG 的 key (例如 news, sport)
-        :return: 一組文章 URL, 若抓取失敗則回傳空的 set
+        :return: 按頁面順序排列的文章 URL list, 若抓取失敗則回傳空 list
         """
-        if name not in self.CATEGORY_CONFIG:
-            raise ValueError(f"Unknown news type {name}")
+        try:
+            path, style = self.CATEGORY_CONFIG[name]
+        except KeyError:
+            raise ValueError(f"Unknown news type {name}") from None
 
-        path, style = self.CATEGORY_CONFIG[name]
         url = self._build_url(path)
-        soup = self._get_soup(url)
+        soup = self._get_soup(url, strainer=self.STYLE_STRAINER[style])
         if soup is None:
-            return set()
+            return []
 
         if style in ("news_style", "culture_style"):
             return self._parse_grid_page(soup, style)
@@ -181,44 +393,58 @@ class BBCNewsCrawler:
 
         raise ValueError(f"Cannot find the news style: {style}")
 
-    def _extract_article_title(self, soup):
+    # 內文段落的 CSS selector, soupsieve 會編譯並快取, 重複使用不用重解析
+    PARAGRAPH_SELECTOR = (
+        'div[data-component="text-block"] p, '
+        'div[data-component="layout-block"] p'
+    )
+
+    def _extract_article(self, soup):
         """
-        針對傳入的 Beautifulsoup 物件去解析出新聞標題
-        
-        :param soup: Beautifulsoup 物件
-        :return: 新聞標題, 若找不到回傳空字串
+        針對單一文章頁面的 BeautifulSoup 物件, 一次取出標題與內文
+
+        標題取第一個 <h1>; 內文用 CSS selector 直接選出
+        text-block / layout-block 底下的 <p>, 多個段落以 '\n' 分隔,
+        不用像以前每個 <p> 都往上爬一次祖先鏈
+
+        :param soup: 文章頁面的 BeautifulSoup 物件
+        :return: (標題, 內文) tuple, 找不到的部分為空字串
         """
         header = soup.find("h1")
         if header is None:
             logger.warning("Cannot find the title")
-            return ""
-        title = header.get_text(" ", strip=True)
-        return title
-        
-    def _extract_article_paragraphs(self, soup):
-        """
-        針對單一文章頁面的 BeautifulSoup 物件，抓取主要內文中的段落文字。
-
-        只會擷取 data-component 為 "text-block" 或 "layout-block"
-        底下的 <p> 文字, 並用換行符號拼接
+            title = ""
+        else:
+            title = header.get_text(" ", strip=True)
 
-        :param link: 文章的 URL
-        :return: 文章內容文字（多個段落以 '\n' 分隔）, 若抓取失敗則回傳空字串
-        """
         paragraphs = []
-        for p in soup.find_all("p"):
-            parent_block = p.find_parent(
-                "div",
-                attrs = {"data-component": ["text-block", "layout-block"]},
-            )
-            if not parent_block:
-                continue
+        for p in soup.select(self.PARAGRAPH_SELECTOR):
             text = p.get_text(" ", strip=True)
             if text:
                 paragraphs.append(text)
 
-        return "\n".join(paragraphs) 
-    
+        return title, "\n".join(paragraphs)
+
+    def _fetch_and_parse_article(self, link):
+        """
+        抓取並解析單篇文章
+
+        :param link: 文章的 URL
+        :return: (標題, 內文) tuple, 抓取失敗或沒有內文時回傳 None
+        """
+        soup = self._get_soup(link, strainer=self.ARTICLE_STRAINER)
+        if soup is None:
+            logger.warning(f"fail to fetch HTML of {link}")
+            return None
+
+        title, article_text = self._extract_article(soup)
+
+        if not article_text.strip():
+            logger.warning(f"empty article text: {link}")
+            return None
+
+        return title, article_text
+
     def get_articles_by_category(self, name):
         """
         給定一個分類名稱, 抓取該分類所有文章並回傳其標題、內容與連結
@@ -245,21 +471,37 @@ class BBCNewsCrawler:
         if not links:
             logger.warning(f"[{name}] does not find any links")
             return None
-        
+
+        # 先對首頁發一個 HEAD, 把 DNS/TCP/TLS 握手先做掉,
+        # worker threads 就能直接拿到連線池裡的 keep-alive 連線
+        try:
+            self.session.head(self.BASE_URL, timeout=self.timeout)
+        except requests.RequestException:
+            pass
+
+        # 先讀 checkpoint, 上次中斷前抓完的文章直接沿用, 不重打 BBC
+        done = self._load_checkpoint(name)
+
+        def fetch(link):
+            if link in done:
+                return done[link]
+            result = self._fetch_and_parse_article(link)
+            if result is not None:
+                self._append_checkpoint(name, link, result[0], result[1])
+            return result
+
+        # 每篇文章的抓取彼此獨立, 用 thread pool 同時抓,
+        # 整個分類的等待時間從逐篇累加變成最慢的那一篇
+        max_workers = min(8, len(links))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            parsed = list(executor.map(fetch, links))
+
         articles = []
-        for index, link in enumerate(links):
-            soup = self._get_soup(link)
-            if soup is None:
-                logger.warning(f"[{name}] fail to fetch HTML of {link}")
+        for index, (link, result) in enumerate(zip(links, parsed)):
+            if result is None:
                 continue
-            
-            title = self._extract_article_title(soup)
-            article_text = self._extract_article_paragraphs(soup)
 
-            if not article_text.strip():
-                logger.warning(f"[{name}] is empty article text")
-                continue
-            
+            title, article_text = result
             articles.append({
                 "id": index + 1,
                 "title": title,
@@ -275,3 +517,24 @@ class BBCNewsCrawler:
             "category": name,
             "articles": articles,
         }
+
+    def get_all_categories(self, names = None):
+        """
+        一次抓多個分類, 分類之間也平行處理
+
+        單一分類內部已經用 thread pool 抓文章, 這裡再把分類層級平行化,
+        worker 數刻意壓在 4, 搭配 _throttle() 讓打向 BBC 的總 QPS 有上限
+
+        :param names: 分類名稱 list, None 表示 CATEGORY_CONFIG 裡的全部分類
+        :return: {分類名稱: get_articles_by_category() 的回傳值} dict,
+                 抓不到的分類值為 None
+        """
+        names = list(names) if names is not None else list(self.CATEGORY_CONFIG.keys())
+        if not names:
+            return {}
+
+        max_workers = min(4, len(names))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(self.get_articles_by_category, names))
+
+        return dict(zip(names, results))
@@ -0,0 +1,5 @@
+"""gunicorn 等 production WSGI server 的進入點"""
+from app import app
+
+if __name__ == "__main__":
+    app.run()